@@ -0,0 +1,21 @@
+import azure.functions as func
+
+from shared.change_feed import process_changes
+from shared.logging_utils import get_logger
+
+
+logger = get_logger(__name__)
+
+
+def main(documents: func.DocumentList) -> None:
+    # Cosmos DB trigger: batches of changed asset documents, checkpointed in the
+    # leases container once this function returns without raising.
+    if not documents:
+        return
+
+    try:
+        count = process_changes(dict(doc) for doc in documents)
+        logger.info("Projected %s asset changes", count)
+    except Exception as e:
+        logger.error(f"Error in assets_changefeed: {str(e)}", exc_info=True)
+        raise
@@ -6,14 +6,26 @@ import azure.functions as func
 
 from shared.auth import require_api_key, AuthError
 from shared.logging_utils import get_logger
+from shared.rate_limit import admit, RateLimitError
 from shared.storage import generate_blob_write_sas, get_container_name, get_blob_url
 from shared.cosmos_client import upsert_asset_doc
-from shared.sql_client import execute
+from shared.content_index import abandon, acquire, make_content_id, normalize_content_hash, register, release
+from shared.idempotency import (
+    IdempotencyConflict,
+    IdempotencyMismatch,
+    fingerprint,
+    get_idempotency_key,
+    get_idempotency_store,
+)
 
 
 logger = get_logger(__name__)
 
 
+# Lifetime of the upload SAS; a replayed response must not outlive it.
+UPLOAD_SAS_HOURS = 2
+
+
 def main(req: func.HttpRequest) -> func.HttpResponse:
     # Debug: Log request details
     print(f"=== assets_create function called ===")
@@ -28,18 +40,18 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             headers={
                 "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net",
                 "Access-Control-Allow-Methods": "POST, OPTIONS",
-                "Access-Control-Allow-Headers": "Content-Type, x-api-key",
+                "Access-Control-Allow-Headers": "Content-Type, x-api-key, Idempotency-Key",
                 "Access-Control-Max-Age": "3600"
             }
         )
     
     # Get API key from headers (support both lowercase and uppercase)
     api_key = req.headers.get('x-api-key') or req.headers.get('X-Api-Key') or req.headers.get('X-API-Key')
-    print(f"Request method: {req.method}, API Key present: {bool(api_key)}, API Key value: {api_key if api_key else 'None'}")
+    print(f"Request method: {req.method}, API Key present: {bool(api_key)}")
     
     # Validate API key
     try:
-        require_api_key(api_key)
+        key_name = require_api_key(api_key)
     except AuthError as e:
         logger.warning(f"Authentication failed: {str(e)}")
         return func.HttpResponse(
@@ -51,6 +63,26 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             }
         )
 
+    # Admission control before any backend call: per-key rate and concurrency
+    # limits, and priority-aware shedding when this worker is saturated.
+    try:
+        with admit(key_name):
+            return _handle(req, key_name)
+    except RateLimitError as e:
+        logger.warning(f"Rejected request for key '{key_name}': {str(e)}")
+        return func.HttpResponse(
+            json.dumps({'error': 'Too Many Requests', 'message': str(e)}),
+            status_code=429,
+            mimetype='application/json',
+            headers={
+                "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net",
+                "Access-Control-Expose-Headers": "Retry-After",
+                "Retry-After": str(e.retry_after)
+            }
+        )
+
+
+def _handle(req: func.HttpRequest, key_name: str) -> func.HttpResponse:
     try:
         body = req.get_json()
         print(f"Request body: {body}")
@@ -78,25 +110,98 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             }
         )
 
+    # Optional client-computed SHA-256 of the file, used to reuse an identical
+    # blob that has already been uploaded.
+    content_hash = None
+    if body.get('contentHash'):
+        try:
+            content_hash = normalize_content_hash(body['contentHash'])
+        except ValueError as e:
+            return func.HttpResponse(
+                json.dumps({'error': 'Bad Request', 'message': str(e)}),
+                status_code=400,
+                mimetype='application/json',
+                headers={
+                    "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net"
+                }
+            )
+
+    # Replay the stored response for a retried Idempotency-Key instead of
+    # creating another asset, SAS, Cosmos document and SQL row.
+    idempotency_key = get_idempotency_key(req.headers)
+    request_fingerprint = fingerprint(req.get_body())
+    store = get_idempotency_store()
+    if idempotency_key:
+        store_key = f"assets_create:{key_name}:{idempotency_key}"
+        try:
+            stored = store.begin(store_key, request_fingerprint)
+        except IdempotencyConflict as e:
+            return func.HttpResponse(
+                json.dumps({'error': 'Conflict', 'message': str(e)}),
+                status_code=409,
+                mimetype='application/json',
+                headers={
+                    "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net",
+                    "Access-Control-Expose-Headers": "Retry-After",
+                    "Retry-After": "1"
+                }
+            )
+        except IdempotencyMismatch as e:
+            return func.HttpResponse(
+                json.dumps({'error': 'Unprocessable Entity', 'message': str(e)}),
+                status_code=422,
+                mimetype='application/json',
+                headers={
+                    "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net"
+                }
+            )
+        if stored:
+            return func.HttpResponse(
+                stored['body'],
+                status_code=stored['statusCode'],
+                mimetype='application/json',
+                headers={
+                    "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net",
+                    "Idempotent-Replayed": "true"
+                }
+            )
+
+    content_id = make_content_id(key_name, content_hash) if content_hash else None
+    referenced = False
     try:
         asset_id = str(uuid.uuid4())
         print(f"Generated asset_id: {asset_id}")
         
         container = get_container_name()
         print(f"Container name: {container}")
-        
-        blob_name = f"{asset_id}/{file_name}"
-        print(f"Blob name: {blob_name}")
-        
-        sas = generate_blob_write_sas(container, blob_name)
-        print(f"SAS generated: {bool(sas)}")
-        
-        blob_url = get_blob_url(container, blob_name)
-        print(f"Blob URL: {blob_url}")
+
+        existing = acquire(content_id, file_size) if content_id else None
+        if existing:
+            # Identical, server-verified content is already stored: point at it,
+            # no upload needed.
+            referenced = True
+            blob_name = existing['blobName']
+            blob_url = existing['blobUrl']
+            sas = None
+            print(f"Deduplicated against content {content_id} (refCount {existing.get('refCount')})")
+        else:
+            blob_name = f"{asset_id}/{file_name}"
+            print(f"Blob name: {blob_name}")
+            
+            sas = generate_blob_write_sas(container, blob_name, hours=UPLOAD_SAS_HOURS)
+            print(f"SAS generated: {bool(sas)}")
+            
+            blob_url = get_blob_url(container, blob_name)
+            print(f"Blob URL: {blob_url}")
+
+            # Claim the hash; it is only shared once BlobCreated has verified the bytes.
+            if content_id and not register(content_id, content_hash, file_size, asset_id, blob_name):
+                content_id = None
 
         now_iso = datetime.now(timezone.utc).isoformat()
 
-        # Cosmos: initial metadata document
+        # Cosmos: initial metadata document (status pending). The change feed
+        # projects it into SQL file_metadata asynchronously.
         print("Attempting to upsert Cosmos document...")
         doc = {
             'id': asset_id,
@@ -105,35 +210,32 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             'uploadDate': now_iso,
             'fileSize': file_size,
             'blobUrl': blob_url,
+            'status': 'uploaded' if existing else 'pending',
         }
+        if content_id:
+            doc['contentId'] = content_id
+        if existing:
+            doc['contentBlob'] = blob_name
+            doc['deduplicated'] = True
+            doc['deduplicatedFrom'] = existing.get('sourceAssetId')
         upsert_asset_doc(doc)
         print("Cosmos document upserted successfully")
 
-        # SQL: create metadata row (status pending)
-        print("Attempting to insert SQL row...")
-        execute(
-            """
-            INSERT INTO file_metadata (id, user_id, file_name, file_type, file_size, blob_url, status, created_at)
-            VALUES (:id, NULL, :file_name, :file_type, :file_size, :blob_url, 'pending', SYSUTCDATETIME())
-            """,
-            {
-                'id': asset_id,
-                'file_name': file_name,
-                'file_type': file_type,
-                'file_size': file_size,
-                'blob_url': blob_url,
-            },
-        )
-        print("SQL row inserted successfully")
-
         response = {
             'id': asset_id,
             'blobUrl': blob_url,
-            'uploadUrl': f"{blob_url}?{sas}",
+            'uploadUrl': f"{blob_url}?{sas}" if sas else None,
+            'deduplicated': bool(existing),
         }
         logger.info("Created asset %s", asset_id)
+        response_body = json.dumps(response)
+        if idempotency_key:
+            # Replaying an expired uploadUrl would leave the asset pending for
+            # good, so records carrying one expire with the SAS.
+            ttl = UPLOAD_SAS_HOURS * 3600 - 300 if sas else None
+            store.complete(store_key, request_fingerprint, 201, response_body, ttl_seconds=ttl)
         return func.HttpResponse(
-            json.dumps(response),
+            response_body,
             status_code=201,
             mimetype='application/json',
             headers={
@@ -141,6 +243,16 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             }
         )
     except Exception as e:
+        if content_id:
+            try:
+                if referenced:
+                    release(content_id)
+                else:
+                    abandon(content_id, asset_id)
+            except Exception as release_error:
+                logger.warning(f"Failed to release content {content_id}: {release_error}")
+        if idempotency_key:
+            store.abandon(store_key)
         logger.error(f"Error in assets_create: {str(e)}", exc_info=True)
         print(f"ERROR in assets_create: {str(e)}")
         import traceback
@@ -1,14 +1,16 @@
 import json
 import azure.functions as func
+from azure.core.exceptions import ResourceNotFoundError
 
 from shared.auth import require_api_key, AuthError
 from shared.logging_utils import get_logger
-from shared.cosmos_client import delete_asset_doc
-from shared.sql_client import execute
+from shared.rate_limit import admit, RateLimitError
+from shared.content_index import abandon, release
+from shared.cosmos_client import tombstone_asset_doc
 from shared.storage import get_blob_service_client, get_container_name
 
 
-
+logger = get_logger(__name__)
 
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
@@ -27,11 +29,11 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     
     # Get API key from headers (support both lowercase and uppercase)
     api_key = req.headers.get('x-api-key') or req.headers.get('X-Api-Key') or req.headers.get('X-API-Key')
-    print(f"Request method: {req.method}, API Key present: {bool(api_key)}, API Key value: {api_key if api_key else 'None'}")
+    print(f"Request method: {req.method}, API Key present: {bool(api_key)}")
     
     # Validate API key
     try:
-        require_api_key(api_key)
+        key_name = require_api_key(api_key)
     except AuthError as e:
         logger.warning(f"Authentication failed: {str(e)}")
         return func.HttpResponse(
@@ -43,6 +45,26 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             }
         )
 
+    # Admission control before any backend call: per-key rate and concurrency
+    # limits, and priority-aware shedding when this worker is saturated.
+    try:
+        with admit(key_name):
+            return _handle(req, key_name)
+    except RateLimitError as e:
+        logger.warning(f"Rejected request for key '{key_name}': {str(e)}")
+        return func.HttpResponse(
+            json.dumps({'error': 'Too Many Requests', 'message': str(e)}),
+            status_code=429,
+            mimetype='application/json',
+            headers={
+                "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net",
+                "Access-Control-Expose-Headers": "Retry-After",
+                "Retry-After": str(e.retry_after)
+            }
+        )
+
+
+def _handle(req: func.HttpRequest, key_name: str) -> func.HttpResponse:
     asset_id = req.route_params.get('id')
     if not asset_id:
         return func.HttpResponse(
@@ -53,14 +75,32 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             }
         )
 
+    # Tombstone the Cosmos document; the change feed removes the SQL row and
+    # then the document itself. Only the request whose conditional tombstone
+    # replaced the live document gets it back, so concurrent deletes cannot
+    # release the same content reference twice.
+    doc = tombstone_asset_doc(asset_id)
+
+    # Deduplicated content is shared between assets: drop this asset's
+    # reference and only delete the content blob once nobody else points at it.
+    extra = []
+    if doc and doc.get('contentId'):
+        if doc.get('contentBlob'):
+            released_blob = release(doc['contentId'])
+            if released_blob:
+                extra.append(released_blob)
+        else:
+            abandon(doc['contentId'], asset_id)
+
     bsc = get_blob_service_client()
     container = bsc.get_container_client(get_container_name())
     to_delete = [b.name for b in container.list_blobs(name_starts_with=f"{asset_id}/")]
+    to_delete += extra
     for name in to_delete:
-        container.delete_blob(name)
-
-    execute("DELETE FROM file_metadata WHERE id = :id", {"id": asset_id})
-    delete_asset_doc(asset_id)
+        try:
+            container.delete_blob(name)
+        except ResourceNotFoundError:
+            pass
 
     return func.HttpResponse(
         json.dumps({"deleted": True, "id": asset_id}),
@@ -3,6 +3,7 @@ import azure.functions as func
 
 from shared.auth import require_api_key, AuthError
 from shared.logging_utils import get_logger
+from shared.rate_limit import admit, RateLimitError
 from shared.cosmos_client import get_asset_doc
 from shared.sql_client import query_all
 
@@ -26,11 +27,11 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     
     # Get API key from headers (support both lowercase and uppercase)
     api_key = req.headers.get('x-api-key') or req.headers.get('X-Api-Key') or req.headers.get('X-API-Key')
-    print(f"Request method: {req.method}, API Key present: {bool(api_key)}, API Key value: {api_key if api_key else 'None'}")
+    print(f"Request method: {req.method}, API Key present: {bool(api_key)}")
     
     # Validate API key
     try:
-        require_api_key(api_key)
+        key_name = require_api_key(api_key)
     except AuthError as e:
         logger.warning(f"Authentication failed: {str(e)}")
         return func.HttpResponse(
@@ -42,6 +43,26 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             }
         )
 
+    # Admission control before any backend call: per-key rate and concurrency
+    # limits, and priority-aware shedding when this worker is saturated.
+    try:
+        with admit(key_name):
+            return _handle(req, key_name)
+    except RateLimitError as e:
+        logger.warning(f"Rejected request for key '{key_name}': {str(e)}")
+        return func.HttpResponse(
+            json.dumps({'error': 'Too Many Requests', 'message': str(e)}),
+            status_code=429,
+            mimetype='application/json',
+            headers={
+                "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net",
+                "Access-Control-Expose-Headers": "Retry-After",
+                "Retry-After": str(e.retry_after)
+            }
+        )
+
+
+def _handle(req: func.HttpRequest, key_name: str) -> func.HttpResponse:
     asset_id = req.route_params.get('id')
     if not asset_id:
         return func.HttpResponse(
@@ -52,15 +73,20 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             }
         )
 
-    doc = get_asset_doc(asset_id)
+    # Read-only endpoint: served from the read replica / preferred region when configured.
+    doc = get_asset_doc(asset_id, read_only=True)
     row = None
     rows = query_all(
         "SELECT id, file_name AS fileName, file_type AS fileType, file_size AS fileSize, blob_url AS blobUrl, status, created_at AS uploadDate FROM file_metadata WHERE id = :id",
         {"id": asset_id},
+        read_only=True,
     )
     if rows:
         row = rows[0]
 
+    if doc and doc.get('deleted'):
+        doc, row = None, None
+
     if not doc and not row:
         return func.HttpResponse(
             'Not Found',
@@ -70,9 +96,10 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             }
         )
 
-    result = doc or {}
-    if row:
-        result.update(row)
+    # The Cosmos document is written first; the SQL row may still be catching up.
+    result = dict(row or {})
+    if doc:
+        result.update(doc)
     return func.HttpResponse(
         json.dumps(result),
         mimetype='application/json',
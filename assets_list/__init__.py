@@ -4,6 +4,7 @@ import azure.functions as func
 
 from shared.auth import require_api_key, AuthError
 from shared.logging_utils import get_logger
+from shared.rate_limit import admit, RateLimitError
 from shared.sql_client import query_all
 
 
@@ -20,24 +21,24 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     
     # Handle CORS preflight (OPTIONS) requests - no authentication required
     if req.method == 'OPTIONS':
-        
+        return func.HttpResponse(
             '',
             status_code=204,
             headers={
                 "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net",
                 "Access-Control-Allow-Methods": "GET, OPTIONS",
                 "Access-Control-Allow-Headers": "Content-Type, x-api-key",
-                
+                "Access-Control-Max-Age": "3600"
             }
         )
     
     # Get API key from headers (support both lowercase and uppercase)
     api_key = req.headers.get('x-api-key') or req.headers.get('X-Api-Key') or req.headers.get('X-API-Key')
-    print(f"Request method: {req.method}, API Key present: {bool(api_key)}, API Key value: {api_key if api_key else 'None'}")
+    print(f"Request method: {req.method}, API Key present: {bool(api_key)}")
     
     # Validate API key
     try:
-        require_api_key(api_key)
+        key_name = require_api_key(api_key)
     except AuthError as e:
         logger.warning(f"Authentication failed: {str(e)}")
         return func.HttpResponse(
@@ -49,6 +50,26 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             }
         )
 
+    # Admission control before any backend call: per-key rate and concurrency
+    # limits, and priority-aware shedding when this worker is saturated.
+    try:
+        with admit(key_name):
+            return _handle(req, key_name)
+    except RateLimitError as e:
+        logger.warning(f"Rejected request for key '{key_name}': {str(e)}")
+        return func.HttpResponse(
+            json.dumps({'error': 'Too Many Requests', 'message': str(e)}),
+            status_code=429,
+            mimetype='application/json',
+            headers={
+                "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net",
+                "Access-Control-Expose-Headers": "Retry-After",
+                "Retry-After": str(e.retry_after)
+            }
+        )
+
+
+def _handle(req: func.HttpRequest, key_name: str) -> func.HttpResponse:
     try:
         print("Attempting to query database...")
         print(f"SQL_SERVER env: {os.getenv('SQL_SERVER', 'NOT SET')}")
@@ -61,7 +82,8 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                    blob_url AS blobUrl, status, created_at AS uploadDate
             FROM file_metadata
             ORDER BY created_at DESC
-            """
+            """,
+            read_only=True,
         )
         
         print(f"Query returned {len(rows)} rows")
@@ -0,0 +1,75 @@
+from typing import Optional
+
+import azure.functions as func
+from azure.core.exceptions import ResourceNotFoundError
+
+from shared.content_index import CONTENT_PREFIX, release, verify_upload
+from shared.cosmos_client import get_asset_doc, patch_asset_doc
+from shared.logging_utils import get_logger
+from shared.renditions import generate_renditions, is_rendition_blob
+from shared.storage import get_blob_service_client, get_blob_url, get_container_name
+
+
+logger = get_logger(__name__)
+
+
+def main(event: func.EventGridEvent) -> None:
+    # Event Grid BlobCreated fires once the client's upload is committed.
+    if event.event_type != 'Microsoft.Storage.BlobCreated':
+        return
+
+    # Subject: /blobServices/default/containers/{container}/blobs/{name}
+    path = event.subject.partition('/containers/')[2]
+    container, _, blob_name = path.partition('/blobs/')
+    if container != get_container_name() or not blob_name or is_rendition_blob(blob_name):
+        return
+    if blob_name.startswith(CONTENT_PREFIX):
+        return
+
+    asset_id = blob_name.split('/', 1)[0]
+    doc = get_asset_doc(asset_id)
+    if not doc or doc.get('deleted'):
+        logger.info("Skipping renditions for %s: asset not found", blob_name)
+        return
+    if doc.get('blobUrl') != get_blob_url(container, blob_name):
+        return
+
+    if doc.get('contentId') and not doc.get('contentBlob'):
+        blob_name = _verify_content(doc, container, blob_name)
+        if blob_name is None:
+            return
+
+    try:
+        generate_renditions(asset_id, blob_name, doc.get('fileType'))
+    except Exception as e:
+        logger.error(f"Error in assets_renditions for {blob_name}: {str(e)}", exc_info=True)
+        raise
+
+
+def _verify_content(doc, container: str, blob_name: str) -> Optional[str]:
+    """
+    Verify the upload against its claimed contentHash and return the blob the
+    asset now lives in, or None if the asset was deleted meanwhile.
+
+    The client-supplied hash is only trusted once the committed bytes hash to
+    it; until then nothing can be deduplicated against this upload. Once it
+    is verified the asset is repointed at the shared content copy and its
+    private upload is deleted, so each distinct file is stored once.
+    """
+    asset_id = doc['id']
+    entry = verify_upload(doc['contentId'], asset_id, blob_name)
+    if entry is None:
+        patch_asset_doc(asset_id, {'contentId': None})
+        return blob_name
+    container_client = get_blob_service_client().get_container_client(container)
+    if patch_asset_doc(asset_id, {'contentBlob': entry['blobName'], 'blobUrl': entry['blobUrl']}) is None:
+        # Deleted while we verified: give back the reference it would have held.
+        released_blob = release(doc['contentId'])
+        if released_blob:
+            container_client.delete_blob(released_blob)
+        return None
+    try:
+        container_client.delete_blob(blob_name)
+    except ResourceNotFoundError:
+        pass
+    return entry['blobName']
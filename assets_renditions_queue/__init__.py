@@ -0,0 +1,27 @@
+import azure.functions as func
+
+from shared.cosmos_client import get_asset_doc
+from shared.logging_utils import get_logger
+from shared.renditions import copy_renditions, generate_renditions
+
+
+logger = get_logger(__name__)
+
+
+def main(msg: func.QueueMessage) -> None:
+    # Renditions for deduplicated assets, queued by the change feed.
+    asset_id = msg.get_json().get('assetId')
+    doc = get_asset_doc(asset_id) if asset_id else None
+    if not doc or doc.get('deleted') or 'renditions' in doc or not doc.get('contentBlob'):
+        return
+
+    try:
+        # The asset that first uploaded this content normally has renditions
+        # already; copying them server-side is far cheaper than rendering.
+        source_id = doc.get('deduplicatedFrom')
+        if source_id and source_id != asset_id and copy_renditions(asset_id, source_id) is not None:
+            return
+        generate_renditions(asset_id, doc['contentBlob'], doc.get('fileType'))
+    except Exception as e:
+        logger.error(f"Error in assets_renditions_queue for {asset_id}: {str(e)}", exc_info=True)
+        raise
@@ -3,8 +3,15 @@ import azure.functions as func
 
 from shared.auth import require_api_key, AuthError
 from shared.logging_utils import get_logger
-from shared.cosmos_client import get_asset_doc, upsert_asset_doc
-from shared.sql_client import execute
+from shared.rate_limit import admit, RateLimitError
+from shared.cosmos_client import get_asset_doc, patch_asset_doc
+from shared.idempotency import (
+    IdempotencyConflict,
+    IdempotencyMismatch,
+    fingerprint,
+    get_idempotency_key,
+    get_idempotency_store,
+)
 
 
 logger = get_logger(__name__)
@@ -19,18 +26,18 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             headers={
                 "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net",
                 "Access-Control-Allow-Methods": "PUT, OPTIONS",
-                "Access-Control-Allow-Headers": "Content-Type, x-api-key",
+                "Access-Control-Allow-Headers": "Content-Type, x-api-key, Idempotency-Key",
                 "Access-Control-Max-Age": "3600"
             }
         )
     
     # Get API key from headers (support both lowercase and uppercase)
     api_key = req.headers.get('x-api-key') or req.headers.get('X-Api-Key') or req.headers.get('X-API-Key')
-    print(f"Request method: {req.method}, API Key present: {bool(api_key)}, API Key value: {api_key if api_key else 'None'}")
+    print(f"Request method: {req.method}, API Key present: {bool(api_key)}")
     
     # Validate API key
     try:
-        require_api_key(api_key)
+        key_name = require_api_key(api_key)
     except AuthError as e:
         logger.warning(f"Authentication failed: {str(e)}")
         return func.HttpResponse(
@@ -42,6 +49,26 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             }
         )
 
+    # Admission control before any backend call: per-key rate and concurrency
+    # limits, and priority-aware shedding when this worker is saturated.
+    try:
+        with admit(key_name):
+            return _handle(req, key_name)
+    except RateLimitError as e:
+        logger.warning(f"Rejected request for key '{key_name}': {str(e)}")
+        return func.HttpResponse(
+            json.dumps({'error': 'Too Many Requests', 'message': str(e)}),
+            status_code=429,
+            mimetype='application/json',
+            headers={
+                "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net",
+                "Access-Control-Expose-Headers": "Retry-After",
+                "Retry-After": str(e.retry_after)
+            }
+        )
+
+
+def _handle(req: func.HttpRequest, key_name: str) -> func.HttpResponse:
     asset_id = req.route_params.get('id')
     if not asset_id:
         return func.HttpResponse(
@@ -63,39 +90,84 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             }
         )
 
+    idempotency_key = get_idempotency_key(req.headers)
+    request_fingerprint = fingerprint(req.get_body())
+    store = get_idempotency_store()
+    if idempotency_key:
+        store_key = f"assets_update:{key_name}:{asset_id}:{idempotency_key}"
+        try:
+            stored = store.begin(store_key, request_fingerprint)
+        except IdempotencyConflict as e:
+            return func.HttpResponse(
+                json.dumps({'error': 'Conflict', 'message': str(e)}),
+                status_code=409,
+                mimetype='application/json',
+                headers={
+                    "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net",
+                    "Access-Control-Expose-Headers": "Retry-After",
+                    "Retry-After": "1"
+                }
+            )
+        except IdempotencyMismatch as e:
+            return func.HttpResponse(
+                json.dumps({'error': 'Unprocessable Entity', 'message': str(e)}),
+                status_code=422,
+                mimetype='application/json',
+                headers={
+                    "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net"
+                }
+            )
+        if stored:
+            return func.HttpResponse(
+                stored['body'],
+                status_code=stored['statusCode'],
+                mimetype='application/json',
+                headers={
+                    "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net",
+                    "Idempotent-Replayed": "true"
+                }
+            )
+
     update_fields = {}
     for k in ['fileName', 'fileType', 'fileSize', 'blobUrl']:
         if k in body:
             update_fields[k] = body[k]
-
-    # Update Cosmos doc if exists
-    doc = get_asset_doc(asset_id) or {"id": asset_id}
-    doc.update(update_fields)
-    upsert_asset_doc(doc)
-
-    # Update SQL row
-    fields_sql = []
-    params = {"id": asset_id}
-    mapping = {
-        'fileName': 'file_name',
-        'fileType': 'file_type',
-        'fileSize': 'file_size',
-        'blobUrl': 'blob_url',
-    }
-    for k, v in update_fields.items():
-        fields_sql.append(f"{mapping[k]} = :{mapping[k]}")
-        params[mapping[k]] = v
     status = body.get('status')
     if status:
-        fields_sql.append("status = :status")
-        params['status'] = status
+        update_fields['status'] = status
 
-    if fields_sql:
-        sql = "UPDATE file_metadata SET " + ", ".join(fields_sql) + " WHERE id = :id"
-        execute(sql, params)
+    # Cosmos is the only store written here; the change feed updates SQL.
+    # Patch only the fields the client sent: fields written in the background
+    # (renditions, contentBlob) are left alone, and the not-deleted filter is
+    # evaluated atomically with the write, so a tombstone is never overwritten.
+    try:
+        if update_fields:
+            doc = patch_asset_doc(asset_id, update_fields)
+        else:
+            doc = get_asset_doc(asset_id)
+            if doc and doc.get('deleted'):
+                doc = None
+    except Exception:
+        if idempotency_key:
+            store.abandon(store_key)
+        raise
+
+    if not doc:
+        if idempotency_key:
+            store.abandon(store_key)
+        return func.HttpResponse(
+            'Not Found',
+            status_code=404,
+            headers={
+                "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net"
+            }
+        )
 
+    response_body = json.dumps({"id": asset_id, **doc})
+    if idempotency_key:
+        store.complete(store_key, request_fingerprint, 200, response_body)
     return func.HttpResponse(
-        json.dumps({"id": asset_id, **doc}),
+        response_body,
         mimetype='application/json',
         headers={
             "Access-Control-Allow-Origin": "https://mystorage867.z33.web.core.windows.net"
@@ -1,47 +1,97 @@
+import hmac
+import json
 import os
-from typing import Optional
+from typing import Any, Dict, Optional
 
 
 class AuthError(Exception):
     pass
 
 
-def require_api_key(provided_key: Optional[str]) -> None:
+_API_KEYS: Optional[Dict[str, Dict[str, Any]]] = None
+_API_KEYS_INVALID = False
+
+
+def get_api_keys() -> Dict[str, Dict[str, Any]]:
+    """
+    Named API keys and their per-key settings, parsed once per process.
+
+    API_KEYS holds a JSON object mapping a key name to either the key itself
+    or an object with "key" plus optional limits ("rate", "burst",
+    "concurrency", "priority"), e.g.
+    {"frontend": {"key": "...", "rate": 20, "priority": "high"}, "bulk": "..."}.
+    The single API_KEY setting is still accepted as a key named "default".
+
+    Raises:
+        AuthError: If API_KEYS is malformed; every request is then rejected
+            rather than silently running without the configured keys
+    """
+    global _API_KEYS, _API_KEYS_INVALID
+    if _API_KEYS is not None:
+        return _API_KEYS
+    if _API_KEYS_INVALID:
+        raise AuthError('Invalid API key')
+    keys: Dict[str, Dict[str, Any]] = {}
+    raw = os.getenv('API_KEYS')
+    if raw:
+        try:
+            parsed = json.loads(raw)
+            if not isinstance(parsed, dict):
+                raise ValueError('expected a JSON object')
+        except ValueError as e:
+            # Reported once, server side only; clients just see a 401.
+            print(f"ERROR: API_KEYS is not valid, rejecting all requests: {e}")
+            _API_KEYS_INVALID = True
+            raise AuthError('Invalid API key')
+        for name, value in parsed.items():
+            config = dict(value) if isinstance(value, dict) else {'key': value}
+            if config.get('key'):
+                config['key'] = str(config['key']).strip()
+                keys[name] = config
+    legacy = os.getenv('API_KEY')
+    if legacy and 'default' not in keys:
+        keys['default'] = {'key': legacy.strip()}
+    _API_KEYS = keys
+    return keys
+
+
+def require_api_key(provided_key: Optional[str]) -> str:
     """
     Validate API key from request headers.
-    
+
     Args:
         provided_key: The API key from request headers (x-api-key)
-        
+
+    Returns:
+        The name of the matching key ("anonymous" when no keys are configured)
+
     Raises:
         AuthError: If API key is missing or invalid
     """
-    expected = os.getenv('API_KEY')
-    
-    # If API_KEY is not set in environment, skip validation (for development)
-    if not expected:
-        print("WARNING: API_KEY environment variable is not set. Skipping authentication.")
-        return
-    
+    keys = get_api_keys()
+
+    # If no API keys are set in environment, skip validation (for development)
+    if not keys:
+        print("WARNING: API_KEY / API_KEYS environment variables are not set. Skipping authentication.")
+        return 'anonymous'
+
     # Check if API key is provided
     if not provided_key:
-        print(f"ERROR: API key is missing. Expected key is set: {bool(expected)}")
+        print(f"ERROR: API key is missing. Configured keys: {len(keys)}")
         raise AuthError('API key is required')
-    
-    # Strip whitespace from both keys for comparison
+
+    # Strip whitespace before comparison
     provided_key = provided_key.strip()
-    expected = expected.strip()
-    
-    # Check if API key matches
-    if provided_key != expected:
-        # Log detailed comparison (without exposing full keys)
-        print(f"ERROR: Invalid API key provided.")
-        print(f"  Provided key length: {len(provided_key)}, First 3 chars: {provided_key[:3] if len(provided_key) >= 3 else 'N/A'}")
-        print(f"  Expected key length: {len(expected)}, First 3 chars: {expected[:3] if len(expected) >= 3 else 'N/A'}")
-        print(f"  Keys match: {provided_key == expected}")
-        raise AuthError('Invalid API key')
-    
-    print("INFO: API key validation successful")
 
+    # Compare against every key in constant time
+    matched = None
+    for name, config in keys.items():
+        if hmac.compare_digest(provided_key.encode('utf-8'), config['key'].encode('utf-8')):
+            matched = name
 
+    if matched is None:
+        print(f"ERROR: Invalid API key provided (length {len(provided_key)}).")
+        raise AuthError('Invalid API key')
 
+    print(f"INFO: API key validation successful for key '{matched}'")
+    return matched
@@ -0,0 +1,259 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from shared.cosmos_client import delete_asset_doc, get_poison_container
+from shared.logging_utils import get_logger
+from shared.renditions import queue_renditions
+from shared.sql_client import execute
+
+
+logger = get_logger(__name__)
+
+
+# Upsert of the file_metadata projection. created_at comes from the Cosmos
+# uploadDate so replays of the same change produce the same row.
+_PROJECT_ASSET_SQL = """
+    MERGE file_metadata AS target
+    USING (SELECT :id AS id) AS source
+    ON target.id = source.id
+    WHEN MATCHED THEN
+        UPDATE SET file_name = :file_name, file_type = :file_type, file_size = :file_size,
+                   blob_url = :blob_url, status = :status
+    WHEN NOT MATCHED THEN
+        INSERT (id, user_id, file_name, file_type, file_size, blob_url, status, created_at)
+        VALUES (:id, NULL, :file_name, :file_type, :file_size, :blob_url, :status,
+                COALESCE(CONVERT(datetime2, TRY_CONVERT(datetimeoffset, :created_at)), SYSUTCDATETIME()));
+"""
+
+
+class ChangeFeedMetrics:
+    """Lag and throughput counters for the change-feed consumer in this process."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self.batches = 0
+        self.documents = 0
+        self.failures = 0
+        self.dead_lettered = 0
+        self.last_batch_size = 0
+        self.last_lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+        self.last_batch_seconds = 0.0
+
+    def record_batch(self, size: int, lag_seconds: float, duration_seconds: float) -> None:
+        with self._lock:
+            self.batches += 1
+            self.documents += size
+            self.last_batch_size = size
+            self.last_lag_seconds = lag_seconds
+            self.max_lag_seconds = max(self.max_lag_seconds, lag_seconds)
+            self.last_batch_seconds = duration_seconds
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    def record_dead_letter(self) -> None:
+        with self._lock:
+            self.dead_lettered += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = max(time.monotonic() - self._started, 1e-9)
+            return {
+                'batches': self.batches,
+                'documents': self.documents,
+                'failures': self.failures,
+                'deadLettered': self.dead_lettered,
+                'lastBatchSize': self.last_batch_size,
+                'lastLagSeconds': round(self.last_lag_seconds, 3),
+                'maxLagSeconds': round(self.max_lag_seconds, 3),
+                'lastBatchSeconds': round(self.last_batch_seconds, 3),
+                'documentsPerSecond': round(self.documents / elapsed, 3),
+            }
+
+
+metrics = ChangeFeedMetrics()
+
+
+def apply_change(doc: Dict[str, Any]) -> None:
+    """Project one Cosmos asset document into SQL."""
+    asset_id = doc.get('id')
+    if not asset_id:
+        return
+
+    if doc.get('deleted'):
+        # Tombstone written by assets_delete: drop the projection, then the document.
+        execute("DELETE FROM file_metadata WHERE id = :id", {"id": asset_id})
+        delete_asset_doc(asset_id)
+    elif not doc.get('fileName'):
+        logger.warning("Skipping projection of asset %s without fileName", asset_id)
+        return
+    else:
+        execute(
+            _PROJECT_ASSET_SQL,
+            {
+                'id': asset_id,
+                'file_name': doc.get('fileName'),
+                'file_type': doc.get('fileType'),
+                'file_size': doc.get('fileSize'),
+                'blob_url': doc.get('blobUrl'),
+                'status': doc.get('status') or 'pending',
+                'created_at': doc.get('uploadDate'),
+            },
+        )
+
+
+def _dead_letter(doc: Dict[str, Any], error: Exception) -> None:
+    """Park a document that keeps failing so it can be inspected and replayed."""
+    asset_id = str(doc.get('id'))
+    get_poison_container().upsert_item({
+        'id': f"{asset_id}-{doc.get('_ts', int(time.time()))}",
+        'assetId': asset_id,
+        'error': f"{type(error).__name__}: {error}",
+        'failedAt': time.time(),
+        'document': doc,
+    })
+    metrics.record_dead_letter()
+    logger.error("Dead-lettered change for asset %s: %s", asset_id, error)
+
+
+def _queue_renditions(doc: Dict[str, Any]) -> None:
+    # Deduplicated assets reuse a committed blob, so no BlobCreated event
+    # reaches assets_renditions for them. Queue the work rather than doing it
+    # in the projection loop; repeats are no-ops. Kept out of the retry and
+    # dead-letter path: the projection itself has already succeeded.
+    if doc.get('deleted') or not doc.get('deduplicated') or 'renditions' in doc:
+        return
+    try:
+        queue_renditions(doc['id'])
+    except Exception as e:
+        logger.error(f"Failed to queue renditions for {doc['id']}: {e}")
+
+
+def _apply_with_retries(doc: Dict[str, Any]) -> None:
+    attempts = max(int(os.getenv('CHANGE_FEED_DOC_ATTEMPTS', '3')), 1)
+    for attempt in range(1, attempts + 1):
+        try:
+            apply_change(doc)
+        except Exception as e:
+            metrics.record_failure()
+            if attempt == attempts:
+                _dead_letter(doc, e)
+                return
+            logger.warning(f"Projection of {doc.get('id')} failed (attempt {attempt}): {e}")
+            time.sleep(0.5 * attempt)
+        else:
+            _queue_renditions(doc)
+            return
+
+
+def process_changes(docs: Iterable[Dict[str, Any]]) -> int:
+    """
+    Apply a batch of change-feed documents in order.
+
+    Failures are isolated per document: each one is retried a few times and
+    then dead-lettered to the poison container, so one bad document never
+    holds back or discards the rest of the batch. Once the function's retry
+    policy is exhausted Functions checkpoints the lease regardless, so the
+    only error re-raised here is a failure to dead-letter.
+    """
+    started = time.monotonic()
+    batch = list(docs)
+    for doc in batch:
+        _apply_with_retries(doc)
+
+    lag = _lag_seconds(batch)
+    metrics.record_batch(len(batch), lag, time.monotonic() - started)
+    logger.info("Change feed batch processed: %s", metrics.snapshot())
+    return len(batch)
+
+
+def _lag_seconds(batch: List[Dict[str, Any]]) -> float:
+    # _ts is the server-side commit time (epoch seconds) of each document version.
+    stamps = [doc['_ts'] for doc in batch if isinstance(doc.get('_ts'), (int, float))]
+    if not stamps:
+        return 0.0
+    return max(time.time() - min(stamps), 0.0)
+
+
+class InMemoryChangeFeed:
+    """
+    Process-local stand-in for the Cosmos change feed and its lease container.
+
+    Documents are appended with publish() and handed to the handler in batches
+    of at most max_items_per_batch. Each lease keeps its own checkpoint, which
+    only advances after the handler returns. Entries every lease has passed are
+    dropped, so a lease first used later starts from the oldest retained entry.
+    """
+
+    def __init__(self, max_items_per_batch: int = 100) -> None:
+        self.max_items_per_batch = max_items_per_batch
+        self._lock = threading.Lock()
+        self._processing = threading.Lock()
+        self._owner: Optional[int] = None
+        self._log: List[Dict[str, Any]] = []
+        self._base = 0  # absolute position of _log[0]
+        self._leases: Dict[str, int] = {}
+
+    def publish(self, doc: Dict[str, Any]) -> None:
+        entry = dict(doc)
+        entry.setdefault('_ts', int(time.time()))
+        with self._lock:
+            self._log.append(entry)
+
+    def pending(self, lease: str = 'default') -> int:
+        with self._lock:
+            return self._base + len(self._log) - self._checkpoint(lease)
+
+    def _checkpoint(self, lease: str) -> int:
+        return max(self._leases.get(lease, self._base), self._base)
+
+    def _trim(self) -> None:
+        low = min(self._leases.values(), default=self._base)
+        if low > self._base:
+            del self._log[:low - self._base]
+            self._base = low
+
+    def process_pending(
+        self,
+        handler: Callable[[List[Dict[str, Any]]], Any] = process_changes,
+        lease: str = 'default',
+    ) -> int:
+        if self._owner == threading.get_ident():
+            # Published from inside the handler; the running loop picks it up.
+            return 0
+        total = 0
+        with self._processing:
+            self._owner = threading.get_ident()
+            try:
+                while True:
+                    with self._lock:
+                        start = self._checkpoint(lease)
+                        offset = start - self._base
+                        batch = self._log[offset:offset + self.max_items_per_batch]
+                    if not batch:
+                        return total
+                    handler(batch)
+                    with self._lock:
+                        self._leases[lease] = start + len(batch)
+                        self._trim()
+                    total += len(batch)
+            finally:
+                self._owner = None
+
+
+_LOCAL_FEED: Optional[InMemoryChangeFeed] = None
+
+
+def get_local_feed() -> Optional[InMemoryChangeFeed]:
+    """Return the in-memory feed when CHANGE_FEED_MODE=memory, otherwise None."""
+    global _LOCAL_FEED
+    if os.getenv('CHANGE_FEED_MODE', '').lower() != 'memory':
+        return None
+    if _LOCAL_FEED is None:
+        _LOCAL_FEED = InMemoryChangeFeed(int(os.getenv('CHANGE_FEED_MAX_ITEMS', '100')))
+    return _LOCAL_FEED
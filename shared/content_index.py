@@ -0,0 +1,215 @@
+import hashlib
+import os
+import re
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError
+from azure.cosmos import exceptions
+
+from shared.cosmos_client import get_content_container
+from shared.logging_utils import get_logger
+from shared.storage import copy_blob, get_blob_service_client, get_blob_url, get_container_name, hash_blob
+
+
+logger = get_logger(__name__)
+
+
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+CONTENT_PREFIX = 'content/'
+
+
+def normalize_content_hash(value: Any) -> str:
+    """
+    Validate a client-computed SHA-256 of the file bytes.
+
+    Raises:
+        ValueError: If value is not 64 hex characters
+    """
+    content_hash = str(value).strip().lower()
+    if not _SHA256_RE.match(content_hash):
+        raise ValueError('contentHash must be a hex-encoded SHA-256 digest')
+    return content_hash
+
+
+def make_content_id(key_name: str, content_hash: str) -> str:
+    # Entries are scoped per API key, so a deduplicated response can't be used
+    # to probe whether some other client has uploaded a given file.
+    return hashlib.sha256(f"{key_name}:{content_hash}".encode('utf-8')).hexdigest()
+
+
+def acquire(content_id: str, size: int) -> Optional[Dict[str, Any]]:
+    """
+    Add a reference to verified content.
+
+    Returns the index entry (blobName, blobUrl, refCount) when a verified
+    blob with this id and size exists, otherwise None.
+    """
+    container = get_content_container()
+    try:
+        return container.patch_item(
+            item=content_id,
+            partition_key=content_id,
+            patch_operations=[{'op': 'incr', 'path': '/refCount', 'value': 1}],
+            filter_predicate=f"FROM c WHERE c.status = 'complete' AND c.size = {int(size)}",
+        )
+    except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceNotFoundError):
+        return None
+
+
+def register(content_id: str, content_hash: str, size: int, asset_id: str, source_blob: str) -> bool:
+    """
+    Record a pending upload that claims content_hash.
+
+    Nothing is shared until verify_upload() has checked the bytes. Returns
+    False if another upload already claims this content; a pending claim
+    older than the upload SAS lifetime is taken over.
+    """
+    container = get_content_container()
+    entry = {
+        'id': content_id,
+        'contentHash': content_hash,
+        'size': size,
+        'sourceAssetId': asset_id,
+        'sourceBlob': source_blob,
+        'status': 'pending',
+        'refCount': 0,
+        'createdAt': time.time(),
+    }
+    try:
+        container.create_item(entry)
+        return True
+    except exceptions.CosmosResourceExistsError:
+        pass
+
+    try:
+        existing = container.read_item(item=content_id, partition_key=content_id)
+    except exceptions.CosmosResourceNotFoundError:
+        return False
+    stale_after = int(os.getenv('CONTENT_PENDING_STALE_SECONDS', '7200'))
+    if existing.get('status') != 'pending' or time.time() - existing.get('createdAt', 0) < stale_after:
+        return False
+    try:
+        container.replace_item(
+            item=content_id,
+            body=entry,
+            etag=existing['_etag'],
+            match_condition=MatchConditions.IfNotModified,
+        )
+        return True
+    except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceNotFoundError):
+        return False
+
+
+def verify_upload(content_id: str, asset_id: str, source_blob: str) -> Optional[Dict[str, Any]]:
+    """
+    Verify a committed upload against its claimed hash and publish it.
+
+    The source is copied to a fresh content/ blob that no SAS ever grants
+    write access to, and the hash is computed over that copy, so what gets
+    shared cannot change afterwards. On success the entry becomes complete
+    with one reference held by the uploading asset and is returned. On a
+    mismatch the copy and the claim are removed and None is returned.
+    """
+    container = get_content_container()
+    try:
+        entry = container.read_item(item=content_id, partition_key=content_id)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+    if entry.get('sourceAssetId') != asset_id or entry.get('sourceBlob') != source_blob:
+        return None
+    if entry.get('status') == 'complete':
+        return entry
+
+    blob_container = get_container_name()
+    blob_name = f"{CONTENT_PREFIX}{content_id}/{uuid.uuid4()}"
+    copy_blob(blob_container, source_blob, blob_name)
+    digest, size = hash_blob(blob_container, blob_name)
+
+    if digest != entry['contentHash'] or size != entry['size']:
+        logger.warning("Upload %s does not match its claimed content hash", source_blob)
+        _delete_blob(blob_container, blob_name)
+        abandon(content_id, asset_id)
+        return None
+
+    try:
+        return container.patch_item(
+            item=content_id,
+            partition_key=content_id,
+            patch_operations=[
+                {'op': 'set', 'path': '/status', 'value': 'complete'},
+                {'op': 'set', 'path': '/blobName', 'value': blob_name},
+                {'op': 'set', 'path': '/blobUrl', 'value': get_blob_url(blob_container, blob_name)},
+                {'op': 'incr', 'path': '/refCount', 'value': 1},
+            ],
+            filter_predicate="FROM c WHERE c.status = 'pending'",
+        )
+    except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceNotFoundError):
+        # A concurrent BlobCreated delivery published first; keep its copy.
+        _delete_blob(blob_container, blob_name)
+        try:
+            entry = container.read_item(item=content_id, partition_key=content_id)
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+        return entry if entry.get('status') == 'complete' else None
+
+
+def abandon(content_id: str, asset_id: str) -> None:
+    """Drop a still-pending claim made by asset_id."""
+    container = get_content_container()
+    try:
+        entry = container.read_item(item=content_id, partition_key=content_id)
+        if entry.get('status') != 'pending' or entry.get('sourceAssetId') != asset_id:
+            return
+        container.delete_item(
+            item=content_id,
+            partition_key=content_id,
+            etag=entry['_etag'],
+            match_condition=MatchConditions.IfNotModified,
+        )
+    except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceNotFoundError):
+        pass
+
+
+def release(content_id: str) -> Optional[str]:
+    """
+    Drop one reference to content_id.
+
+    Returns the blob name once the last reference is gone and the entry has
+    been removed; the caller deletes that blob. Returns None otherwise.
+    """
+    container = get_content_container()
+    try:
+        entry = container.patch_item(
+            item=content_id,
+            partition_key=content_id,
+            patch_operations=[{'op': 'incr', 'path': '/refCount', 'value': -1}],
+        )
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+
+    if entry.get('refCount', 0) > 0:
+        return None
+
+    # Conditional on the etag: an acquire() racing with us bumps it and wins.
+    try:
+        container.delete_item(
+            item=content_id,
+            partition_key=content_id,
+            etag=entry.get('_etag'),
+            match_condition=MatchConditions.IfNotModified,
+        )
+    except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceNotFoundError):
+        return None
+    logger.info("Released last reference to content %s", content_id)
+    return entry.get('blobName')
+
+
+def _delete_blob(container: str, blob_name: str) -> None:
+    try:
+        get_blob_service_client().get_blob_client(container, blob_name).delete_blob()
+    except ResourceNotFoundError:
+        pass
@@ -1,23 +1,95 @@
 import os
+import time
+from datetime import datetime, timezone
 from typing import Dict, Any, Optional
+from azure.core import MatchConditions
 from azure.cosmos import CosmosClient, PartitionKey, exceptions
 
 
+_DATABASE = None
 _CONTAINER = None
+_READ_CONTAINER = None
+_READ_CONTAINER_RETRY_AT = 0.0
+_IDEMPOTENCY_CONTAINER = None
+_CONTENT_CONTAINER = None
+_POISON_CONTAINER = None
 
-def get_container():
-    global _CONTAINER
+
+def _get_database():
+    global _DATABASE
+    if _DATABASE is None:
+        endpoint = os.getenv('COSMOS_ENDPOINT')
+        key = os.getenv('COSMOS_KEY')
+        if not endpoint or not key:
+            raise ValueError("COSMOS_ENDPOINT and COSMOS_KEY must be set")
+        db_name = os.getenv('COSMOS_DB_NAME', 'media-platform')
+        client = CosmosClient(endpoint, key)
+        _DATABASE = client.create_database_if_not_exists(db_name)
+    return _DATABASE
+
+
+# Weakest first; a client may relax the account default but not strengthen it.
+_CONSISTENCY_ORDER = ['Eventual', 'ConsistentPrefix', 'Session', 'BoundedStaleness', 'Strong']
+
+
+def _get_read_container():
+    """
+    Assets container on a dedicated read client, or None to read through the
+    primary client.
+
+    Only used when COSMOS_PREFERRED_LOCATIONS (comma-separated regions) is
+    set, to route reads to the nearest replica. COSMOS_READ_CONSISTENCY
+    (ConsistentPrefix, Eventual, ...) can additionally relax the account
+    default for those reads; a level stronger than the account default is
+    rejected by the service, so it is ignored with a warning.
+    """
+    global _READ_CONTAINER
+    if _READ_CONTAINER is None:
+        locations = [loc.strip() for loc in os.getenv('COSMOS_PREFERRED_LOCATIONS', '').split(',') if loc.strip()]
+        if not locations:
+            return None
+        endpoint = os.getenv('COSMOS_ENDPOINT')
+        key = os.getenv('COSMOS_KEY')
+        if not endpoint or not key:
+            raise ValueError("COSMOS_ENDPOINT and COSMOS_KEY must be set")
+        client = CosmosClient(endpoint, key, preferred_locations=locations)
+        consistency = os.getenv('COSMOS_READ_CONSISTENCY') or None
+        if consistency:
+            policy = client.get_database_account().ConsistencyPolicy or {}
+            default = policy.get('defaultConsistencyLevel')
+            if consistency not in _CONSISTENCY_ORDER or default not in _CONSISTENCY_ORDER:
+                import logging
+                logging.warning(f"Ignoring COSMOS_READ_CONSISTENCY={consistency} (account default {default})")
+            elif _CONSISTENCY_ORDER.index(consistency) > _CONSISTENCY_ORDER.index(default):
+                import logging
+                logging.warning(
+                    f"Ignoring COSMOS_READ_CONSISTENCY={consistency}: stronger than the account default {default}"
+                )
+            elif consistency != default:
+                client = CosmosClient(endpoint, key, consistency_level=consistency, preferred_locations=locations)
+        db = client.get_database_client(os.getenv('COSMOS_DB_NAME', 'media-platform'))
+        _READ_CONTAINER = db.get_container_client(os.getenv('COSMOS_CONTAINER', 'assets'))
+    return _READ_CONTAINER
+
+
+def get_container(read_only: bool = False):
+    global _CONTAINER, _READ_CONTAINER_RETRY_AT
+    if read_only and time.monotonic() >= _READ_CONTAINER_RETRY_AT:
+        try:
+            read_container = _get_read_container()
+            if read_container is not None:
+                return read_container
+        except Exception as e:
+            # Don't make every read wait on the same failure; use the primary
+            # for a while before trying to build the read client again.
+            backoff = float(os.getenv('COSMOS_READ_CLIENT_RETRY_SECONDS', '300'))
+            _READ_CONTAINER_RETRY_AT = time.monotonic() + backoff
+            import logging
+            logging.warning(f"Failed to initialize Cosmos DB read client, using primary for {backoff:g}s: {e}")
     if _CONTAINER is None:
         try:
-            endpoint = os.getenv('COSMOS_ENDPOINT')
-            key = os.getenv('COSMOS_KEY')
-            if not endpoint or not key:
-                raise ValueError("COSMOS_ENDPOINT and COSMOS_KEY must be set")
-            db_name = os.getenv('COSMOS_DB_NAME', 'media-platform')
             container_name = os.getenv('COSMOS_CONTAINER', 'assets')
-            client = CosmosClient(endpoint, key)
-            db = client.create_database_if_not_exists(db_name)
-            _CONTAINER = db.create_container_if_not_exists(
+            _CONTAINER = _get_database().create_container_if_not_exists(
                 id=container_name,
                 partition_key=PartitionKey(path="/id"),
                 offer_throughput=400,
@@ -29,17 +101,145 @@ def get_container():
     return _CONTAINER
 
 
+def get_idempotency_container():
+    """Container for shared idempotency records; items expire via the container TTL."""
+    global _IDEMPOTENCY_CONTAINER
+    if _IDEMPOTENCY_CONTAINER is None:
+        try:
+            container_name = os.getenv('COSMOS_IDEMPOTENCY_CONTAINER', 'idempotency')
+            _IDEMPOTENCY_CONTAINER = _get_database().create_container_if_not_exists(
+                id=container_name,
+                partition_key=PartitionKey(path="/id"),
+                default_ttl=int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400')),
+                offer_throughput=400,
+            )
+        except Exception as e:
+            import logging
+            logging.error(f"Failed to initialize Cosmos DB idempotency container: {e}")
+            raise
+    return _IDEMPOTENCY_CONTAINER
+
+
+def get_content_container():
+    """Container for the content-hash index, one item per distinct blob content."""
+    global _CONTENT_CONTAINER
+    if _CONTENT_CONTAINER is None:
+        try:
+            container_name = os.getenv('COSMOS_CONTENT_CONTAINER', 'content')
+            _CONTENT_CONTAINER = _get_database().create_container_if_not_exists(
+                id=container_name,
+                partition_key=PartitionKey(path="/id"),
+                offer_throughput=400,
+            )
+        except Exception as e:
+            import logging
+            logging.error(f"Failed to initialize Cosmos DB content container: {e}")
+            raise
+    return _CONTENT_CONTAINER
+
+
+def get_poison_container():
+    """Dead-letter container for change-feed documents that could not be projected."""
+    global _POISON_CONTAINER
+    if _POISON_CONTAINER is None:
+        try:
+            container_name = os.getenv('COSMOS_POISON_CONTAINER', 'poison')
+            _POISON_CONTAINER = _get_database().create_container_if_not_exists(
+                id=container_name,
+                partition_key=PartitionKey(path="/assetId"),
+                offer_throughput=400,
+            )
+        except Exception as e:
+            import logging
+            logging.error(f"Failed to initialize Cosmos DB poison container: {e}")
+            raise
+    return _POISON_CONTAINER
+
+
 def upsert_asset_doc(doc: Dict[str, Any]) -> Dict[str, Any]:
     container = get_container()
-    return container.upsert_item(doc)
+    result = container.upsert_item(doc)
+    _publish_local_change(result)
+    return result
 
 
-def get_asset_doc(asset_id: str) -> Optional[Dict[str, Any]]:
-    container = get_container()
+def get_asset_doc(asset_id: str, read_only: bool = False) -> Optional[Dict[str, Any]]:
+    container = get_container(read_only=read_only)
+    primary = get_container()
     try:
         return container.read_item(item=asset_id, partition_key=asset_id)
     except exceptions.CosmosResourceNotFoundError:
+        if container is primary:
+            return None
+        # The read client has its own session, so a document just created
+        # through the primary may not be visible to it yet; ask the primary.
+        try:
+            return primary.read_item(item=asset_id, partition_key=asset_id)
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+    except exceptions.CosmosHttpResponseError as e:
+        if container is primary:
+            raise
+        import logging
+        logging.warning(f"Cosmos read client failed, falling back to primary: {e}")
+        try:
+            return primary.read_item(item=asset_id, partition_key=asset_id)
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+
+
+def patch_asset_doc(asset_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Set top-level fields on an existing document without a read-modify-write."""
+    container = get_container()
+    operations = [{'op': 'set', 'path': f'/{k}', 'value': v} for k, v in fields.items()]
+    try:
+        result = container.patch_item(
+            item=asset_id,
+            partition_key=asset_id,
+            patch_operations=operations,
+            filter_predicate="FROM c WHERE NOT IS_DEFINED(c.deleted)",
+        )
+    except (exceptions.CosmosResourceNotFoundError, exceptions.CosmosAccessConditionFailedError):
         return None
+    _publish_local_change(result)
+    return result
+
+
+def tombstone_asset_doc(asset_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Replace the asset document with a deletion tombstone.
+
+    The replace is conditional on the document's etag, so when several deletes
+    race exactly one of them gets the live document back; the others (and
+    deletes of missing or already tombstoned assets) get None.
+    """
+    container = get_container()
+    for _ in range(3):
+        tombstone = {
+            'id': asset_id,
+            'deleted': True,
+            'deletedAt': datetime.now(timezone.utc).isoformat(),
+        }
+        try:
+            doc = container.read_item(item=asset_id, partition_key=asset_id)
+        except exceptions.CosmosResourceNotFoundError:
+            # Still tombstone so the change feed clears any SQL row left behind.
+            _publish_local_change(container.upsert_item(tombstone))
+            return None
+        if doc.get('deleted'):
+            return None
+        try:
+            result = container.replace_item(
+                item=asset_id,
+                body=tombstone,
+                etag=doc['_etag'],
+                match_condition=MatchConditions.IfNotModified,
+            )
+        except exceptions.CosmosAccessConditionFailedError:
+            continue
+        _publish_local_change(result)
+        return doc
+    raise RuntimeError(f"Asset {asset_id} kept changing while being deleted")
 
 
 def delete_asset_doc(asset_id: str) -> None:
@@ -50,4 +250,17 @@ def delete_asset_doc(asset_id: str) -> None:
         pass
 
 
-
+def _publish_local_change(doc: Dict[str, Any]) -> None:
+    # Without the Cosmos trigger (CHANGE_FEED_MODE=memory) feed the in-process
+    # stand-in and drain it straight away so SQL stays in step locally. The
+    # Cosmos write has already succeeded, so projection problems are logged
+    # rather than failing the caller; undrained changes are retried next time.
+    from shared.change_feed import get_local_feed
+    feed = get_local_feed()
+    if feed is not None:
+        feed.publish(doc)
+        try:
+            feed.process_pending()
+        except Exception as e:
+            import logging
+            logging.error(f"Local change feed processing failed: {e}")
@@ -0,0 +1,282 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from shared.logging_utils import get_logger
+
+
+logger = get_logger(__name__)
+
+
+PENDING = 'pending'
+COMPLETED = 'completed'
+
+
+class IdempotencyConflict(Exception):
+    """The same Idempotency-Key is still being processed by another request."""
+    pass
+
+
+class IdempotencyMismatch(Exception):
+    """The Idempotency-Key was already used with a different request body."""
+    pass
+
+
+def get_idempotency_key(headers) -> Optional[str]:
+    key = headers.get('Idempotency-Key') or headers.get('idempotency-key')
+    if not key:
+        return None
+    key = key.strip()
+    return key or None
+
+
+def fingerprint(body: bytes) -> str:
+    return hashlib.sha256(body or b'').hexdigest()
+
+
+class _MemoryBackend:
+    """Bounded in-process record store with per-entry expiry."""
+
+    def __init__(self, ttl_seconds: int, max_entries: int) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+
+    def _get_locked(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, record = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return record
+
+    def _put_locked(self, key: str, record: Dict[str, Any], ttl_seconds: int) -> None:
+        self._entries[key] = (time.monotonic() + ttl_seconds, record)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._get_locked(key)
+
+    def reserve(self, key: str, record: Dict[str, Any], ttl_seconds: int) -> Optional[Dict[str, Any]]:
+        """Store record unless key is present; return the existing record if it is."""
+        with self._lock:
+            existing = self._get_locked(key)
+            if existing is not None:
+                return existing
+            self._put_locked(key, record, ttl_seconds)
+            return None
+
+    def put(self, key: str, record: Dict[str, Any], ttl_seconds: Optional[int] = None) -> None:
+        with self._lock:
+            self._put_locked(key, record, min(ttl_seconds or self.ttl_seconds, self.ttl_seconds))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class _CosmosBackend:
+    """Shared record store in a Cosmos container with a default TTL."""
+
+    def __init__(self) -> None:
+        from azure.cosmos import exceptions
+        from shared.cosmos_client import get_idempotency_container
+        self._exceptions = exceptions
+        self._container = get_idempotency_container()
+
+    @staticmethod
+    def _doc_id(key: str) -> str:
+        # Cosmos ids may not contain '/', '\\', '?' or '#'.
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        doc_id = self._doc_id(key)
+        try:
+            return self._container.read_item(item=doc_id, partition_key=doc_id)
+        except self._exceptions.CosmosResourceNotFoundError:
+            return None
+
+    def reserve(self, key: str, record: Dict[str, Any], ttl_seconds: int) -> Optional[Dict[str, Any]]:
+        doc = dict(record, id=self._doc_id(key), ttl=ttl_seconds)
+        try:
+            self._container.create_item(doc)
+            return None
+        except self._exceptions.CosmosResourceExistsError:
+            return self.get(key)
+
+    def put(self, key: str, record: Dict[str, Any], ttl_seconds: Optional[int] = None) -> None:
+        # Without a per-item ttl, completed records use the container default TTL.
+        doc = dict(record, id=self._doc_id(key))
+        if ttl_seconds:
+            doc['ttl'] = ttl_seconds
+        self._container.upsert_item(doc)
+
+    def delete(self, key: str) -> None:
+        doc_id = self._doc_id(key)
+        try:
+            self._container.delete_item(item=doc_id, partition_key=doc_id)
+        except self._exceptions.CosmosResourceNotFoundError:
+            pass
+
+
+def _remaining_ttl(doc: Dict[str, Any]) -> Optional[int]:
+    # A Cosmos record with its own ttl expires _ts + ttl; don't cache it longer.
+    if not doc.get('ttl') or not doc.get('_ts'):
+        return None
+    return max(int(doc['_ts'] + doc['ttl'] - time.time()), 1)
+
+
+class IdempotencyStore:
+    """
+    Response store for Idempotency-Key replays.
+
+    Completed responses are cached in-process and, when a shared backend is
+    configured, in Cosmos so retries landing on another instance also replay.
+    A pending marker with a short TTL is reserved while the first request
+    runs, so a concurrent retry gets a conflict instead of a second write.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = 86400,
+        pending_ttl_seconds: int = 60,
+        max_entries: int = 10000,
+        shared_backend: Optional[Any] = None,
+        report_seconds: float = 60.0,
+    ) -> None:
+        self.pending_ttl_seconds = pending_ttl_seconds
+        self.report_seconds = report_seconds
+        self._last_report = time.monotonic()
+        self._local = _MemoryBackend(ttl_seconds, max_entries)
+        self._shared = shared_backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+        self.mismatches = 0
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+        self._maybe_report()
+
+    def _maybe_report(self) -> None:
+        # Emitted on every outcome (not just replays) so a falling hit rate or
+        # a run of misses and conflicts is visible too.
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_report < self.report_seconds:
+                return
+            self._last_report = now
+        logger.info("Idempotency store metrics: %s", self.metrics())
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'conflicts': self.conflicts,
+                'mismatches': self.mismatches,
+                'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def begin(self, key: str, request_fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the stored response for key, or reserve key and return None.
+
+        Raises:
+            IdempotencyConflict: If the key is reserved by an in-flight request
+            IdempotencyMismatch: If the key was used with a different body
+        """
+        pending = {'state': PENDING, 'fingerprint': request_fingerprint}
+        existing = self._local.get(key)
+        if existing is None and self._shared is not None:
+            try:
+                existing = self._shared.reserve(key, pending, self.pending_ttl_seconds)
+            except Exception as e:
+                logger.warning(f"Idempotency shared backend lookup failed: {e}")
+            if existing is not None and existing.get('state') == COMPLETED:
+                self._local.put(key, existing, _remaining_ttl(existing))
+        if existing is None:
+            existing = self._local.reserve(key, pending, self.pending_ttl_seconds)
+
+        if existing is None:
+            self._count('misses')
+            return None
+        if existing.get('fingerprint') != request_fingerprint:
+            self._count('mismatches')
+            raise IdempotencyMismatch('Idempotency-Key was already used with a different request body')
+        if existing.get('state') != COMPLETED:
+            self._count('conflicts')
+            raise IdempotencyConflict('A request with this Idempotency-Key is still in progress')
+
+        self._count('hits')
+        logger.info("Idempotent replay for key %s", key)
+        return existing
+
+    def complete(
+        self,
+        key: str,
+        request_fingerprint: str,
+        status_code: int,
+        body: str,
+        ttl_seconds: Optional[int] = None,
+    ) -> None:
+        """
+        Store the response for replay, for ttl_seconds when given (capped at
+        the store TTL), e.g. while a URL embedded in the body stays valid.
+        """
+        record = {
+            'state': COMPLETED,
+            'fingerprint': request_fingerprint,
+            'statusCode': status_code,
+            'body': body,
+        }
+        self._local.put(key, record, ttl_seconds)
+        if self._shared is not None:
+            try:
+                self._shared.put(key, record, ttl_seconds)
+            except Exception as e:
+                logger.warning(f"Failed to store idempotency record in shared backend: {e}")
+
+    def abandon(self, key: str) -> None:
+        """Drop the reservation so the client can retry after a failure."""
+        self._local.delete(key)
+        if self._shared is not None:
+            try:
+                self._shared.delete(key)
+            except Exception as e:
+                logger.warning(f"Failed to release idempotency key in shared backend: {e}")
+
+
+_STORE: Optional[IdempotencyStore] = None
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    global _STORE
+    if _STORE is None:
+        shared_backend = None
+        if os.getenv('IDEMPOTENCY_BACKEND', 'memory').lower() == 'cosmos':
+            try:
+                shared_backend = _CosmosBackend()
+            except Exception as e:
+                logger.warning(f"Idempotency shared backend unavailable, using in-process store only: {e}")
+        _STORE = IdempotencyStore(
+            ttl_seconds=int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400')),
+            pending_ttl_seconds=int(os.getenv('IDEMPOTENCY_PENDING_TTL_SECONDS', '60')),
+            max_entries=int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', '10000')),
+            shared_backend=shared_backend,
+            report_seconds=float(os.getenv('IDEMPOTENCY_REPORT_SECONDS', '60')),
+        )
+    return _STORE
@@ -0,0 +1,198 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator
+
+from shared.auth import get_api_keys
+from shared.logging_utils import get_logger
+
+
+logger = get_logger(__name__)
+
+
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+
+class RateLimitError(Exception):
+    """Request rejected before any backend call; retry after retry_after seconds."""
+
+    def __init__(self, message: str, retry_after: int = 1) -> None:
+        super().__init__(message)
+        self.retry_after = max(int(retry_after), 1)
+
+
+@dataclass
+class KeyPolicy:
+    rate: float
+    burst: int
+    concurrency: int
+    priority: str = 'normal'
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """Take one token; return 0 on success or the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        if self.rate <= 0:
+            return 60.0
+        return (1 - self.tokens) / self.rate
+
+
+@dataclass
+class _KeyState:
+    policy: KeyPolicy
+    bucket: TokenBucket
+    in_flight: int = 0
+    counters: Dict[str, int] = field(default_factory=lambda: {
+        'admitted': 0, 'throttled': 0, 'concurrencyLimited': 0, 'shed': 0,
+    })
+
+
+_POLICIES: Dict[str, KeyPolicy] = {}
+
+
+def policy_for(key_name: str) -> KeyPolicy:
+    """Limits for a named key from API_KEYS, falling back to the RATE_LIMIT_* defaults."""
+    policy = _POLICIES.get(key_name)
+    if policy is None:
+        policy = _POLICIES[key_name] = _build_policy(get_api_keys().get(key_name, {}))
+    return policy
+
+
+def _build_policy(config: Dict[str, Any]) -> KeyPolicy:
+    priority = str(config.get('priority', 'normal')).lower()
+    return KeyPolicy(
+        rate=float(config.get('rate', os.getenv('RATE_LIMIT_DEFAULT_RATE', '10'))),
+        burst=int(config.get('burst', os.getenv('RATE_LIMIT_DEFAULT_BURST', '20'))),
+        concurrency=int(config.get('concurrency', os.getenv('RATE_LIMIT_DEFAULT_CONCURRENCY', '4'))),
+        priority=priority if priority in PRIORITIES else 'normal',
+    )
+
+
+class AdmissionController:
+    """
+    Per-key token buckets and concurrency limits plus load shedding.
+
+    In flight counts admitted requests still executing in this Python worker
+    process. Synchronous functions run on the worker's thread pool, so it
+    never exceeds PYTHON_THREADPOOL_THREAD_COUNT; requests waiting for a free
+    thread are queued by the host and invisible here. max_in_flight therefore
+    defaults to the pool size, and once in flight reaches a priority's share
+    of it that priority is shed, low before normal before high. State is per
+    process; each instance enforces its own share of the limits.
+    """
+
+    def __init__(self, max_in_flight: int, shed_fractions: Dict[str, float], report_seconds: float = 60.0) -> None:
+        self.max_in_flight = max_in_flight
+        self.shed_fractions = shed_fractions
+        self.report_seconds = report_seconds
+        self._lock = threading.Lock()
+        self._keys: Dict[str, _KeyState] = {}
+        self._in_flight = 0
+        self._last_report = time.monotonic()
+
+    def _state(self, key_name: str) -> _KeyState:
+        state = self._keys.get(key_name)
+        if state is None:
+            policy = policy_for(key_name)
+            state = _KeyState(policy=policy, bucket=TokenBucket(policy.rate, policy.burst))
+            self._keys[key_name] = state
+        return state
+
+    def _reject(self, state: _KeyState, counter: str, message: str, retry_after: float) -> None:
+        state.counters[counter] += 1
+        raise RateLimitError(message, math.ceil(retry_after))
+
+    @contextmanager
+    def admit(self, key_name: str) -> Iterator[None]:
+        with self._lock:
+            state = self._state(key_name)
+            policy = state.policy
+            limit = self.max_in_flight * self.shed_fractions.get(policy.priority, 1.0)
+            if self._in_flight >= limit:
+                self._reject(state, 'shed', 'Server is busy, request shed', 1)
+            if state.in_flight >= policy.concurrency:
+                self._reject(state, 'concurrencyLimited', f"Concurrency limit of {policy.concurrency} reached", 1)
+            wait = state.bucket.try_acquire()
+            if wait > 0:
+                self._reject(state, 'throttled', f"Rate limit of {policy.rate:g} requests/second exceeded", wait)
+            state.counters['admitted'] += 1
+            state.in_flight += 1
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                state.in_flight -= 1
+                self._in_flight -= 1
+            self._maybe_report()
+
+    def usage(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'inFlight': self._in_flight,
+                'keys': {
+                    name: dict(state.counters, inFlight=state.in_flight)
+                    for name, state in self._keys.items()
+                },
+            }
+
+    def _maybe_report(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_report < self.report_seconds:
+                return
+            self._last_report = now
+        logger.info("API key usage: %s", self.usage())
+
+
+def _default_max_in_flight() -> int:
+    # Size of the worker's thread pool: PYTHON_THREADPOOL_THREAD_COUNT, or the
+    # ThreadPoolExecutor default the Python worker falls back to without it.
+    threads = os.getenv('PYTHON_THREADPOOL_THREAD_COUNT')
+    if threads:
+        return int(threads)
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+_CONTROLLER = None
+
+
+def get_admission_controller() -> AdmissionController:
+    global _CONTROLLER
+    if _CONTROLLER is None:
+        _CONTROLLER = AdmissionController(
+            max_in_flight=int(os.getenv('LOAD_SHED_MAX_IN_FLIGHT') or _default_max_in_flight()),
+            shed_fractions={
+                'high': float(os.getenv('LOAD_SHED_HIGH_FRACTION', '1.0')),
+                'normal': float(os.getenv('LOAD_SHED_NORMAL_FRACTION', '0.8')),
+                'low': float(os.getenv('LOAD_SHED_LOW_FRACTION', '0.5')),
+            },
+            report_seconds=float(os.getenv('RATE_LIMIT_REPORT_SECONDS', '60')),
+        )
+    return _CONTROLLER
+
+
+def admit(key_name: str):
+    """
+    Context manager admitting one request for key_name.
+
+    Raises:
+        RateLimitError: If the key is over its rate or concurrency limit, or
+            the request is shed under load
+    """
+    return get_admission_controller().admit(key_name)
@@ -0,0 +1,252 @@
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import ContentSettings
+
+from shared.cosmos_client import get_asset_doc, patch_asset_doc
+from shared.logging_utils import get_logger
+from shared.storage import (
+    copy_blob,
+    generate_blob_read_sas,
+    get_blob_service_client,
+    get_blob_url,
+    get_container_name,
+    get_queue_client,
+)
+
+
+logger = get_logger(__name__)
+
+
+# (name, longest edge in pixels). Stored as {asset_id}/renditions/{name}.jpg so
+# assets_delete removes them with the rest of the asset prefix.
+RENDITION_SPECS: Tuple[Tuple[str, int], ...] = (
+    ('thumbnail', 256),
+    ('preview', 1280),
+)
+
+RENDITION_PREFIX = 'renditions/'
+
+
+def is_rendition_blob(blob_name: str) -> bool:
+    return f"/{RENDITION_PREFIX}" in blob_name
+
+
+def _extract_video_frame(source: str) -> Optional[str]:
+    """Grab one frame with ffmpeg; source may be a local path or an HTTPS URL."""
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return None
+    fd, frame_path = tempfile.mkstemp(prefix='rendition-frame-', suffix='.jpg')
+    os.close(fd)
+    try:
+        # -ss before -i seeks in the input, so over HTTP ffmpeg only fetches the
+        # byte ranges it needs rather than the whole file.
+        result = subprocess.run(
+            [ffmpeg, '-y', '-loglevel', 'error', '-ss', '1', '-i', source, '-frames:v', '1', frame_path],
+            capture_output=True,
+            timeout=120,
+        )
+        if result.returncode != 0 or not os.path.getsize(frame_path):
+            # Clips shorter than a second have no frame at 1s; fall back to the first one.
+            result = subprocess.run(
+                [ffmpeg, '-y', '-loglevel', 'error', '-i', source, '-frames:v', '1', frame_path],
+                capture_output=True,
+                timeout=120,
+            )
+    except subprocess.TimeoutExpired:
+        result = None
+    if result is not None and result.returncode == 0 and os.path.getsize(frame_path):
+        return frame_path
+    os.remove(frame_path)
+    return None
+
+
+def render(source: str, file_type: str, specs: Tuple[Tuple[str, int], ...] = RENDITION_SPECS) -> Dict[str, bytes]:
+    """
+    Produce JPEG renditions of an image file or a video. Runs inside the process pool.
+
+    Images are read from a local path; for video, source may also be a URL
+    that ffmpeg reads directly. Returns an empty dict for unsupported or
+    undecodable sources, or when Pillow (or ffmpeg, for video) is not available.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return {}
+
+    image_path = source
+    frame_path = None
+    if (file_type or '').startswith('video/'):
+        frame_path = _extract_video_frame(source)
+        if not frame_path:
+            return {}
+        image_path = frame_path
+    elif not (file_type or '').startswith('image/'):
+        return {}
+
+    try:
+        with Image.open(image_path) as img:
+            img.draft('RGB', (max(edge for _, edge in specs),) * 2)
+            img = ImageOps.exif_transpose(img).convert('RGB')
+            outputs = {}
+            for name, edge in specs:
+                copy = img.copy()
+                copy.thumbnail((edge, edge), Image.LANCZOS)
+                buf = io.BytesIO()
+                copy.save(buf, format='JPEG', quality=85, optimize=True, progressive=True)
+                outputs[name] = buf.getvalue()
+            return outputs
+    except (OSError, Image.DecompressionBombError):
+        # Formats Pillow can't decode (SVG, HEIC, ...), corrupt files and
+        # oversized images have no renditions; raising would only make the
+        # trigger retry the same blob. UnidentifiedImageError is an OSError.
+        return {}
+    finally:
+        if frame_path and os.path.exists(frame_path):
+            os.remove(frame_path)
+
+
+_EXECUTOR: Optional[ProcessPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            workers = int(os.getenv('RENDITION_WORKERS', '0')) or (os.cpu_count() or 1)
+            # spawn rather than fork: the Functions worker process is multi-threaded.
+            _EXECUTOR = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _EXECUTOR
+
+
+def _reset_executor(broken: ProcessPoolExecutor) -> None:
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        # Another thread may already have replaced it.
+        if _EXECUTOR is broken:
+            _EXECUTOR = None
+    broken.shutdown(wait=False)
+
+
+def _render_in_pool(source: str, file_type: str, timeout: int) -> Dict[str, bytes]:
+    executor = get_executor()
+    try:
+        return executor.submit(render, source, file_type).result(timeout=timeout)
+    except BrokenProcessPool:
+        # A child died (e.g. OOM-killed on a huge image) and took the pool with
+        # it; start a fresh one and try this source once more.
+        logger.warning("Rendition process pool broken, restarting it")
+        _reset_executor(executor)
+        return get_executor().submit(render, source, file_type).result(timeout=timeout)
+
+
+def generate_renditions(asset_id: str, blob_name: str, file_type: str) -> Optional[Dict[str, str]]:
+    """
+    Render an asset's source blob and record the rendition URLs on its document.
+
+    Unsupported types are recorded as having no renditions without touching
+    the blob. Images are streamed to a temp file; videos are read by ffmpeg
+    through a short-lived read SAS, so only the bytes around the sampled frame
+    are fetched. Results are uploaded under {asset_id}/renditions/. Returns the
+    name -> URL map, or None if the asset no longer exists.
+    """
+    container = get_container_name()
+    container_client = get_blob_service_client().get_container_client(container)
+    timeout = int(os.getenv('RENDITION_TIMEOUT_SECONDS', '300'))
+
+    outputs: Dict[str, bytes] = {}
+    if (file_type or '').startswith('video/'):
+        sas = generate_blob_read_sas(container, blob_name, minutes=max(timeout // 60, 1) + 5)
+        source_url = f"{get_blob_url(container, blob_name)}?{sas}"
+        outputs = _render_in_pool(source_url, file_type, timeout)
+    elif (file_type or '').startswith('image/'):
+        fd, source_path = tempfile.mkstemp(prefix='rendition-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                container_client.download_blob(blob_name).readinto(f)
+            outputs = _render_in_pool(source_path, file_type, timeout)
+        finally:
+            os.remove(source_path)
+
+    renditions = {}
+    for name, data in outputs.items():
+        rendition_name = f"{asset_id}/{RENDITION_PREFIX}{name}.jpg"
+        container_client.upload_blob(
+            rendition_name,
+            data,
+            overwrite=True,
+            content_settings=ContentSettings(content_type='image/jpeg'),
+        )
+        renditions[name] = get_blob_url(container, rendition_name)
+
+    if _record(asset_id, renditions) is None:
+        return None
+    logger.info("Generated %s renditions for asset %s", len(renditions), asset_id)
+    return renditions
+
+
+def copy_renditions(asset_id: str, source_asset_id: str) -> Optional[Dict[str, str]]:
+    """
+    Reuse another asset's renditions via server-side copies.
+
+    Returns the name -> URL map recorded on asset_id, or None when the source
+    has no renditions (yet, or any more) or asset_id no longer exists.
+    """
+    source = get_asset_doc(source_asset_id)
+    if not source or source.get('deleted') or 'renditions' not in source:
+        return None
+
+    container = get_container_name()
+    renditions = {}
+    try:
+        for name in source['renditions']:
+            rendition_name = f"{asset_id}/{RENDITION_PREFIX}{name}.jpg"
+            copy_blob(container, f"{source_asset_id}/{RENDITION_PREFIX}{name}.jpg", rendition_name, timeout_seconds=60)
+            renditions[name] = get_blob_url(container, rendition_name)
+    except ResourceNotFoundError:
+        # Source deleted mid-copy; the caller renders instead.
+        _delete_renditions(asset_id, renditions)
+        return None
+
+    if _record(asset_id, renditions) is None:
+        return None
+    logger.info("Copied %s renditions from asset %s to %s", len(renditions), source_asset_id, asset_id)
+    return renditions
+
+
+def queue_renditions(asset_id: str) -> None:
+    """Hand an asset to assets_renditions_queue, off the caller's path."""
+    queue = get_queue_client(os.getenv('RENDITION_QUEUE', 'renditions'))
+    queue.send_message(json.dumps({'assetId': asset_id}))
+
+
+def _record(asset_id: str, renditions: Dict[str, str]) -> Optional[Dict[str, str]]:
+    # An empty map still marks the asset as processed.
+    if patch_asset_doc(asset_id, {'renditions': renditions}) is None:
+        _delete_renditions(asset_id, renditions)
+        return None
+    return renditions
+
+
+def _delete_renditions(asset_id: str, names) -> None:
+    container_client = get_blob_service_client().get_container_client(get_container_name())
+    for name in names:
+        try:
+            container_client.delete_blob(f"{asset_id}/{RENDITION_PREFIX}{name}.jpg")
+        except ResourceNotFoundError:
+            pass
@@ -3,6 +3,7 @@ from typing import Any, Dict, List, Optional
 
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
 
 
 def _build_connection_string() -> str:
@@ -18,11 +19,58 @@ def _build_connection_string() -> str:
     )
 
 
+def _build_read_connection_string() -> Optional[str]:
+    """
+    Connection string for read-only queries, or None to read from the primary.
+
+    SQL_READ_URL takes any SQLAlchemy URL (e.g. a second local instance).
+    Otherwise SQL_READ_SERVER / SQL_READ_DATABASE point at a replica and
+    SQL_READ_INTENT=true adds ApplicationIntent=ReadOnly, which routes Azure
+    SQL connections to the built-in read scale-out replica.
+    """
+    read_url = os.getenv('SQL_READ_URL')
+    if read_url:
+        return read_url
+    read_server = os.getenv('SQL_READ_SERVER')
+    read_intent = os.getenv('SQL_READ_INTENT', 'false').lower() == 'true'
+    if not read_server and not read_intent:
+        return None
+    server = read_server or os.getenv('SQL_SERVER')
+    database = os.getenv('SQL_READ_DATABASE') or os.getenv('SQL_DATABASE')
+    username = os.getenv('SQL_USERNAME')
+    password = os.getenv('SQL_PASSWORD')
+    encrypt = os.getenv('SQL_ENCRYPT', 'true')
+    driver = os.getenv('SQL_DRIVER', 'ODBC Driver 18 for SQL Server')
+    conn_str = (
+        f"mssql+pyodbc://{username}:{password}@{server}:1433/{database}?"
+        f"driver={driver.replace(' ', '+')}&Encrypt={encrypt}&TrustServerCertificate=no"
+    )
+    if read_intent:
+        conn_str += "&ApplicationIntent=ReadOnly"
+    return conn_str
+
+
 _ENGINE: Optional[Engine] = None
+_READ_ENGINE: Optional[Engine] = None
 
 
-def get_engine() -> Engine:
-    global _ENGINE
+def get_engine(read_only: bool = False) -> Engine:
+    """
+    Return the primary engine, or the read replica engine when read_only is
+    set and one is configured.
+    """
+    global _ENGINE, _READ_ENGINE
+    if read_only:
+        if _READ_ENGINE is None:
+            read_conn_str = _build_read_connection_string()
+            if read_conn_str:
+                try:
+                    _READ_ENGINE = create_engine(read_conn_str, pool_pre_ping=True)
+                except Exception as e:
+                    import logging
+                    logging.warning(f"Failed to create SQL read engine, using primary: {e}")
+        if _READ_ENGINE is not None:
+            return _READ_ENGINE
     if _ENGINE is None:
         try:
             _ENGINE = create_engine(_build_connection_string(), pool_pre_ping=True)
@@ -35,18 +83,27 @@ def get_engine() -> Engine:
     return _ENGINE
 
 
-def query_all(sql: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
-    engine = get_engine()
+def _fetch_all(engine: Engine, sql: str, params: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
     with engine.connect() as conn:
         result = conn.execute(text(sql), params or {})
         columns = result.keys()
         return [dict(zip(columns, row)) for row in result.fetchall()]
 
 
+def query_all(sql: str, params: Optional[Dict[str, Any]] = None, read_only: bool = False) -> List[Dict[str, Any]]:
+    engine = get_engine(read_only=read_only)
+    primary = get_engine()
+    if engine is primary:
+        return _fetch_all(primary, sql, params)
+    try:
+        return _fetch_all(engine, sql, params)
+    except DBAPIError as e:
+        import logging
+        logging.warning(f"SQL read replica query failed, falling back to primary: {e}")
+        return _fetch_all(primary, sql, params)
+
+
 def execute(sql: str, params: Optional[Dict[str, Any]] = None) -> None:
     engine = get_engine()
     with engine.begin() as conn:
         conn.execute(text(sql), params or {})
-
-
-
@@ -1,12 +1,16 @@
+import hashlib
 import os
+import time
 from datetime import datetime, timedelta
-from typing import Tuple
+from typing import Dict, Tuple
 
+from azure.core.exceptions import ResourceExistsError
 from azure.storage.blob import (
     BlobServiceClient,
     BlobSasPermissions,
     generate_blob_sas,
 )
+from azure.storage.queue import QueueClient, TextBase64EncodePolicy
 
 
 def get_blob_service_client() -> BlobServiceClient:
@@ -18,6 +22,26 @@ def get_container_name() -> str:
     return os.getenv('AZURE_STORAGE_CONTAINER', 'assets')
 
 
+_QUEUE_CLIENTS: Dict[str, QueueClient] = {}
+
+
+def get_queue_client(queue_name: str) -> QueueClient:
+    client = _QUEUE_CLIENTS.get(queue_name)
+    if client is None:
+        # Base64 is what the Functions queue trigger expects by default.
+        client = QueueClient.from_connection_string(
+            os.getenv('AZURE_STORAGE_CONNECTION_STRING'),
+            queue_name,
+            message_encode_policy=TextBase64EncodePolicy(),
+        )
+        try:
+            client.create_queue()
+        except ResourceExistsError:
+            pass
+        _QUEUE_CLIENTS[queue_name] = client
+    return client
+
+
 def generate_blob_write_sas(container: str, blob_name: str, hours: int = 2) -> str:
     account_name = os.getenv('AZURE_STORAGE_ACCOUNT')
     account_key = _extract_account_key_from_connection_string(os.getenv('AZURE_STORAGE_CONNECTION_STRING', ''))
@@ -33,6 +57,48 @@ def generate_blob_write_sas(container: str, blob_name: str, hours: int = 2) -> s
     return sas
 
 
+def generate_blob_read_sas(container: str, blob_name: str, minutes: int = 15) -> str:
+    account_name = os.getenv('AZURE_STORAGE_ACCOUNT')
+    account_key = _extract_account_key_from_connection_string(os.getenv('AZURE_STORAGE_CONNECTION_STRING', ''))
+    return generate_blob_sas(
+        account_name=account_name,
+        container_name=container,
+        blob_name=blob_name,
+        account_key=account_key,
+        permission=BlobSasPermissions(read=True),
+        expiry=datetime.utcnow() + timedelta(minutes=minutes),
+    )
+
+
+def copy_blob(container: str, source_name: str, dest_name: str, timeout_seconds: int = 300) -> None:
+    """Server-side copy within the account, waiting until the copy has completed."""
+    source_url = f"{get_blob_url(container, source_name)}?{generate_blob_read_sas(container, source_name)}"
+    dest = get_blob_service_client().get_blob_client(container, dest_name)
+    dest.start_copy_from_url(source_url)
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+        copy = dest.get_blob_properties().copy
+        if copy.status == 'success':
+            return
+        if copy.status in ('failed', 'aborted'):
+            raise RuntimeError(f"Copy of {source_name} to {dest_name} {copy.status}: {copy.status_description}")
+        if time.monotonic() > deadline:
+            dest.abort_copy(copy.id)
+            raise TimeoutError(f"Copy of {source_name} to {dest_name} did not finish in {timeout_seconds}s")
+        time.sleep(1)
+
+
+def hash_blob(container: str, blob_name: str) -> Tuple[str, int]:
+    """Stream a blob and return its SHA-256 hex digest and size."""
+    blob = get_blob_service_client().get_blob_client(container, blob_name)
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in blob.download_blob().chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
 def get_blob_url(container: str, blob_name: str) -> str:
     account = os.getenv('AZURE_STORAGE_ACCOUNT')
     return f"https://{account}.blob.core.windows.net/{container}/{blob_name}"